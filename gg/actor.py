@@ -17,21 +17,15 @@
 
 from __future__ import division
 
-from gi.repository import Gtk, Champlain, Clutter
+from gi.repository import GLib, Champlain, Clutter
 from gettext import gettext as _
-from time import sleep
 
 from common import get_obj, map_view
 from gpsmath import format_coords
 
-def display(view, param, mlink, label):
-    """Display map center coordinates when they change."""
-    lat, lon = [ view.get_property(x) for x in ('latitude', 'longitude') ]
-    label.set_markup(format_coords(lat, lon))
-    mlink.set_markup(
-        '<a title="%s" href="%s?ll=%s,%s&amp;spn=%s,%s">Google</a>'
-        % (_('View in Google Maps'), 'http://maps.google.com/maps', lat, lon,
-        lon - view.x_to_longitude(0), view.y_to_latitude(0) - lat))
+MAPS_LINK  = ('<a title="%s" href="http://maps.google.com/maps'
+              '?ll=%s,%s&amp;spn=%s,%s">Google</a>')
+MAPS_TITLE = _('View in Google Maps')
 
 
 class ActorController():
@@ -44,13 +38,11 @@ class ActorController():
         self.label.set_color(Clutter.Color.new(255, 255, 255, 255))
         self.xhair = Clutter.Rectangle.new_with_color(
             Clutter.Color.new(0, 0, 0, 64))
+        self.pending = False
         for signal in [ 'latitude', 'longitude' ]:
-            map_view.connect('notify::' + signal, display,
+            map_view.connect('notify::' + signal, self.queue_display,
                 get_obj('maps_link'), self.label)
-        map_view.connect('notify::width',
-            lambda view, param, black:
-                black.set_size(view.get_width(), 30),
-            self.black)
+        map_view.connect('notify::width', self.resize)
         
         scale = Champlain.Scale.new()
         scale.connect_view(map_view)
@@ -61,17 +53,43 @@ class ActorController():
         self.black.get_layout_manager().add(self.label,
             Clutter.BinAlignment.CENTER, Clutter.BinAlignment.CENTER)
     
+    def resize(self, view, param):
+        """Stretch the coordinate display across the top of the map."""
+        self.black.set_size(view.get_width(), 30)
+    
+    def queue_display(self, view, param, mlink, label):
+        """Only redraw the coordinates once per burst of map movement.
+        
+        Panning the map notifies latitude and longitude many times per
+        frame, so the actual work is deferred until the main loop is idle.
+        """
+        if not self.pending:
+            self.pending = True
+            GLib.idle_add(self.display, view, mlink, label)
+    
+    def display(self, view, mlink, label):
+        """Display map center coordinates when they change."""
+        self.pending = False
+        lat, lon = [ view.get_property(x) for x in ('latitude', 'longitude') ]
+        label.set_markup(format_coords(lat, lon))
+        mlink.set_markup(MAPS_LINK % (MAPS_TITLE, lat, lon,
+            lon - view.x_to_longitude(0), view.y_to_latitude(0) - lat))
+        return False
+    
     def animate_in(self, start):
         """Animate the crosshair."""
         map_view.bin_layout_add(self.xhair,
             Clutter.BinAlignment.CENTER, Clutter.BinAlignment.CENTER)
         self.xhair.set_z_rotation_from_gravity(45, Clutter.Gravity.CENTER)
-        for i in xrange(start, 7, -1):
-            self.xhair.set_size(i, i)
-            opacity = 0.6407035175879398 * (400 - i) # don't ask
-            for actor in [self.xhair, self.label, self.black]:
-                actor.set_opacity(opacity)
-            while Gtk.events_pending():
-                Gtk.main_iteration()
-            sleep(0.01)
-
+        opacity = lambda size: 0.6407035175879398 * (400 - size) # don't ask
+        duration = max(0, start - 8) * 10
+        self.xhair.set_size(start, start)
+        for actor in (self.xhair, self.label, self.black):
+            actor.set_opacity(opacity(start))
+            actor.save_easing_state()
+            actor.set_easing_mode(Clutter.AnimationMode.LINEAR)
+            actor.set_easing_duration(duration)
+            actor.set_opacity(opacity(8))
+            if actor is self.xhair:
+                actor.set_size(8, 8)
+            actor.restore_easing_state()
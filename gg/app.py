@@ -30,12 +30,17 @@ GObject.threads_init()
 GObject.set_prgname(PACKAGE)
 GtkClutter.init([])
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib
 from gi.repository import GdkPixbuf
 from gi.repository import Champlain
+from multiprocessing.pool import ThreadPool
+from multiprocessing import cpu_count
 from os.path import join, basename, abspath
+from os import stat, environ
 from gettext import gettext as _
-from time import clock
+from time import clock, time
+from itertools import izip
+from collections import OrderedDict
 from sys import argv
 
 # "If I have seen a little further it is by standing on the shoulders of Giants."
@@ -43,11 +48,11 @@ from sys import argv
 
 from photos import Photograph
 from xmlfiles import GPXFile, KMLFile
-from common import polygons, points, photos
+from common import polygons, points, stamps, photos
 from common import auto_timestamp_comparison
 from common import metadata, selected, modified
 from common import Struct, get_obj, gst, map_view
-from common import gpx_sensitivity, clear_all_gpx
+from common import gpx_sensitivity, clear_all_gpx, pump_events
 
 from drag import DragController
 from actor import ActorController
@@ -59,6 +64,9 @@ from preferences import PreferencesController
 # Handy names for GtkListStore column numbers.
 PATH, SUMMARY, THUMB, TIMESTAMP = range(4)
 
+# GTK_TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, which GI doesn't expose.
+UNSORTED = -2
+
 def toggle_selected_photos(button, sel):
     """Toggle the selection of photos."""
     (sel.select_all if button.get_active() else sel.unselect_all)()
@@ -79,14 +87,24 @@ class GottenGeography():
     def open_files(self, files):
         """Attempt to load all of the specified files."""
         self.progressbar.show()
-        invalid, total = [], len(files)
-        for i, name in enumerate(files, 1):
-            self.redraw_interface(i / total, basename(name))
-            try:
-                try:            self.load_img_from_file(name)
-                except IOError: self.load_gpx_from_file(name)
-            except IOError:
-                invalid.append(basename(name))
+        # Keep the liststore from re-sorting itself after every single row,
+        # and just sort it once when everything is loaded.
+        self.liststore.set_sort_column_id(UNSORTED, Gtk.SortType.ASCENDING)
+        invalid, total, redraw = [], len(files), 0
+        try:
+            for i, name in enumerate(files, 1):
+                # Only redraw every 50ms, loading each photo can be quicker.
+                if time() > redraw:
+                    self.redraw_interface(i / total, basename(name))
+                    redraw = time() + 0.05
+                try:
+                    try:            self.load_img_from_file(name)
+                    except IOError: self.load_gpx_from_file(name)
+                except IOError:
+                    invalid.append(basename(name))
+        finally:
+            self.liststore.set_sort_column_id(TIMESTAMP,
+                Gtk.SortType.ASCENDING)
         if invalid:
             self.status_message(_('Could not open: ') + ', '.join(invalid))
         self.progressbar.hide()
@@ -114,6 +132,58 @@ class GottenGeography():
         self.liststore.set_row(photo.iter,
             [uri, photo.long_summary(), photo.thumb, photo.timestamp])
         auto_timestamp_comparison(photo)
+        self.thumbs_pending += 1
+        self.thumb_pool.apply_async(self.decode_thumb,
+            (photo, photo.preview is not None))
+    
+    def decode_thumb(self, photo, fallback):
+        """Decode a thumbnail in the thumb_pool, and pass it to the main loop.
+        
+        The pool would silently discard any exception raised here, so
+        failures are caught and handled from the main loop too. The fallback
+        argument says whether an embedded preview was already tried.
+        """
+        try:
+            photo.load_thumb()
+        except IOError:
+            GLib.idle_add(self.thumb_failed, photo, fallback)
+        else:
+            GLib.idle_add(self.insert_thumb, photo)
+    
+    def thumb_failed(self, photo, fallback):
+        """Retry with an embedded preview, or remember that it failed."""
+        if photos.get(photo.filename) is photo:
+            if not fallback:
+                photo.preview = photo.embedded_preview()
+                if photo.preview is not None:
+                    self.thumbs_pending += 1
+                    self.thumb_pool.apply_async(self.decode_thumb,
+                        (photo, True))
+            else:
+                self.thumb_errors.append(basename(photo.filename))
+        return self.thumb_finished()
+    
+    def insert_thumb(self, photo):
+        """Display a thumbnail once the thumb_pool has finished decoding it."""
+        if photos.get(photo.filename) is photo:
+            self.liststore.set_value(photo.iter, THUMB, photo.thumb)
+        return self.thumb_finished()
+    
+    def thumb_finished(self):
+        """Report every failed thumbnail at once, when the pool is done.
+        
+        This happens after open_files has shown its own message, so the
+        failures are added to that message rather than replacing it.
+        """
+        self.thumbs_pending -= 1
+        if self.thumbs_pending == 0 and self.thumb_errors:
+            message = _('Could not load thumbnails: ') + \
+                ', '.join(self.thumb_errors)
+            if self.error.bar.get_visible():
+                message = self.error.message.get_text() + '\n' + message
+            self.status_message(message)
+            del self.thumb_errors[:]
+        return False
     
     def load_gpx_from_file(self, uri):
         """Parse GPX data, drawing each GPS track segment on the map."""
@@ -126,12 +196,13 @@ class GottenGeography():
         get_obj('colorselection').emit('color-changed')
         
         self.status_message(_('%d points loaded in %.2fs.') %
-            (len(gpx.tracks), clock() - start_time), True)
+            (len(gpx.timestamps), clock() - start_time), True)
         
-        if len(gpx.tracks) < 2:
+        if len(gpx.timestamps) < 2:
             return
         
-        points.update(gpx.tracks)
+        points.update(izip(gpx.timestamps, gpx.markers))
+        stamps[:] = sorted(points)
         metadata.alpha = min(metadata.alpha, gpx.alpha)
         metadata.omega = max(metadata.omega, gpx.omega)
         
@@ -172,9 +243,11 @@ class GottenGeography():
     def save_all_files(self, widget=None):
         """Ensure all loaded files are saved."""
         self.progressbar.show()
-        total = len(modified)
+        total, redraw = len(modified), 0
         for i, photo in enumerate(list(modified), 1):
-            self.redraw_interface(i / total, basename(photo.filename))
+            if time() > redraw:
+                self.redraw_interface(i / total, basename(photo.filename))
+                redraw = time() + 0.05
             try:
                 photo.write()
             except Exception as inst:
@@ -198,10 +271,18 @@ class GottenGeography():
         if offset != metadata.delta:
             metadata.delta = offset
             if abs(seconds) == 60 and abs(minutes) != 60:
+                # Rolling the seconds over into the minutes doesn't change
+                # the offset, so don't let either spinbutton come back here
+                # and place every photo again at a bogus intermediate offset.
                 minutes += seconds / 60
+                for spinbutton in [ self.secbutton, self.minbutton ]:
+                    spinbutton.handler_block_by_func(self.time_offset_changed)
                 self.secbutton.set_value(0)
                 self.minbutton.set_value(minutes)
-            for photo in photos.values():
+                for spinbutton in [ self.secbutton, self.minbutton ]:
+                    spinbutton.handler_unblock_by_func(
+                        self.time_offset_changed)
+            for photo in photos.itervalues():
                 auto_timestamp_comparison(photo)
     
     def modify_summary(self, photo):
@@ -214,19 +295,59 @@ class GottenGeography():
 # Dialogs. Various dialog-related methods for user interaction.
 ################################################################################
     
-    def update_preview(self, chooser, label, image):
-        """Display photo thumbnail and geotag data in file chooser."""
+    def queue_preview(self, chooser, label, image):
+        """Only preview the file that the user stops on.
+        
+        Holding down an arrow key in the file chooser passes over many files,
+        so wait until the selection settles before reading anything.
+        """
         label.set_label(self.strings.preview)
         image.set_from_stock(Gtk.STOCK_FILE, Gtk.IconSize.DIALOG)
+        if self.preview_source:
+            GLib.source_remove(self.preview_source)
+        self.preview_source = GLib.timeout_add(80, self.update_preview,
+            chooser, label, image)
+    
+    def update_preview(self, chooser, label, image, previews=OrderedDict()):
+        """Display photo thumbnail and geotag data in file chooser.
+        
+        Users tend to click back and forth between the same few files, so
+        the thumbnail and summary of the 64 most recently previewed files are
+        cached until the file is modified. Photo times depend on the TZ
+        environment variable, so it is part of the key too. The previews
+        argument persists across calls to this method and should not be
+        passed as an argument.
+        """
+        self.preview_source = None
+        filename = chooser.get_preview_filename()
         try:
-            photo = Photograph(chooser.get_preview_filename(),
-                               lambda x: None, 300)
-            photo.read()
-        except IOError:
-            return
-        image.set_from_pixbuf(photo.thumb)
-        label.set_label(
-            '\n'.join([photo.short_summary(), photo.maps_link()]))
+            key = (filename, stat(filename).st_mtime, environ.get('TZ'))
+        except (TypeError, OSError):
+            return False
+        if key in previews:
+            # Move this preview to the end, so that it is evicted last.
+            previews[key] = previews.pop(key)
+        else:
+            photo = Photograph(filename, lambda x: None, 300)
+            try:
+                photo.read()
+                if photo.preview is None:
+                    photo.preview = photo.embedded_preview(fits=True)
+                try:
+                    photo.load_thumb()
+                except IOError:
+                    # The preview is released either way, so try the photo.
+                    photo.load_thumb()
+            except IOError:
+                return False
+            if len(previews) >= 64:
+                previews.popitem(last=False)
+            previews[key] = (photo.thumb,
+                '\n'.join([photo.short_summary(), photo.maps_link()]))
+        thumb, summary = previews[key]
+        image.set_from_pixbuf(thumb)
+        label.set_label(summary)
+        return False
     
     def add_files_dialog(self, button, chooser):
         """Display a file chooser, and attempt to load chosen files."""
@@ -256,6 +377,11 @@ class GottenGeography():
     def __init__(self):
         self.progressbar = get_obj('progressbar')
         
+        # Thumbnails are decoded in the background, one thread per core.
+        self.thumb_pool     = ThreadPool(cpu_count())
+        self.thumbs_pending = 0
+        self.thumb_errors   = []
+        
         self.error = Struct({
             'message': get_obj('error_message'),
             'icon': get_obj('error_icon'),
@@ -264,9 +390,12 @@ class GottenGeography():
         
         self.error.bar.connect('response', lambda widget, signal: widget.hide())
         
+        chooser       = get_obj('open')
+        preview_label = get_obj('preview_label')
+        
         self.strings = Struct({
             'quit':    get_obj('quit').get_property('secondary-text'),
-            'preview': get_obj('preview_label').get_text()
+            'preview': preview_label.get_text()
         })
         
         self.liststore = get_obj('loaded_photos')
@@ -301,7 +430,7 @@ class GottenGeography():
             join(PKG_DATA_DIR, PACKAGE + '.svg'), 192, 192))
         
         click_handlers = {
-            'open_button':       [self.add_files_dialog, get_obj('open')],
+            'open_button':       [self.add_files_dialog, chooser],
             'save_button':       [self.save_all_files],
             'clear_button':      [clear_all_gpx],
             'close_button':      [self.close_selected_photos],
@@ -323,11 +452,12 @@ class GottenGeography():
         # Hide the unused button that appears beside the map source menu.
         get_obj('map_source_menu_button').get_child().get_children()[0].set_visible(False)
         
-        save_size = lambda v, s, size: gst.set_window_size(size())
+        self.resizing = False
         for prop in ['width', 'height']:
-            map_view.connect('notify::' + prop, save_size, window.get_size)
+            map_view.connect('notify::' + prop, self.queue_save_size,
+                window.get_size)
         
-        accel.connect(Gdk.keyval_from_name('q'),
+        accel.connect(Gdk.KEY_q,
             Gdk.ModifierType.CONTROL_MASK, 0, self.confirm_quit_dialog)
         
         self.labels.selection.emit('changed')
@@ -342,8 +472,21 @@ class GottenGeography():
         
         gst.bind('left-pane-page', get_obj('photo_camera_gps'), 'page')
         
-        get_obj('open').connect('update-preview', self.update_preview,
-            get_obj('preview_label'), get_obj('preview_image'))
+        self.preview_source = None
+        chooser.connect('update-preview', self.queue_preview,
+            preview_label, get_obj('preview_image'))
+    
+    def queue_save_size(self, view, param, get_size):
+        """Width and height change together, so only save the size once."""
+        if not self.resizing:
+            self.resizing = True
+            GLib.idle_add(self.save_size, get_size)
+    
+    def save_size(self, get_size):
+        """Remember the window size for the next time the app is launched."""
+        self.resizing = False
+        gst.set_window_size(get_size())
+        return False
     
     def redraw_interface(self, fraction=None, text=None):
         """Tell Gtk to redraw the user interface, so it doesn't look hung.
@@ -354,7 +497,7 @@ class GottenGeography():
         """
         if fraction is not None: self.progressbar.set_fraction(fraction)
         if text is not None:     self.progressbar.set_text(str(text))
-        while Gtk.events_pending(): Gtk.main_iteration()
+        pump_events()
     
     def status_message(self, message, info=False):
         """Display a message with the GtkInfoBar."""
@@ -25,6 +25,9 @@ polygons but is also iterated over during unloading of GPS data.
 The `points` dict maps epoch seconds to ChamplainCoordinate() instances. This
 is used to place photos on the map by looking up their timestamps.
 
+The `stamps` list holds the keys of `points` in sorted order, so that the
+points surrounding a photo's timestamp can be found with a binary search.
+
 The `photos` dict maps absolute filename paths to Photograph() instances, and
 is used for most of the photo manipulations (eg, loading, saving, etc).
 """
@@ -34,6 +37,7 @@ from __future__ import division
 from gi.repository import Gtk, Gio, GLib
 from gi.repository import GtkChamplain, Champlain
 from os.path import join
+from bisect import bisect_left
 
 from build_info import PKG_DATA_DIR
 from version import PACKAGE
@@ -43,6 +47,7 @@ selected = set()
 modified = set()
 polygons = []
 points   = {}
+stamps   = []
 photos   = {}
 
 
@@ -79,8 +84,9 @@ def auto_timestamp_comparison(photo):
 
     except KeyError:
         # Find the two points that are nearest (in time) to the photo.
-        hi = min(point for point in points if point > stamp)
-        lo = max(point for point in points if point < stamp)
+        index = bisect_left(stamps, stamp)
+        hi = stamps[index]
+        lo = stamps[index - 1]
         hi_point = points[hi]
         lo_point = points[lo]
         hi_ratio = (stamp - lo) / (hi - lo)  # Proportional amount of time
@@ -101,9 +107,18 @@ class Builder(Gtk.Builder):
     """Load GottenGeography's UI definitions."""
     def __init__(self):
         Gtk.Builder.__init__(self)
+        self.widgets = {}
         
         self.set_translation_domain(PACKAGE)
         self.add_from_file(join(PKG_DATA_DIR, PACKAGE + '.ui'))
+    
+    def get_object(self, name):
+        """Cache widget lookups, the UI doesn't change once it's loaded."""
+        try:
+            return self.widgets[name]
+        except KeyError:
+            widget = self.widgets[name] = Gtk.Builder.get_object(self, name)
+            return widget
 
 
 class GSettings(Gio.Settings):
@@ -199,6 +214,18 @@ def add_polygon_to_map():
     map_view.add_layer(polygon)
     return polygon.append_point
 
+def pump_events(limit=100):
+    """Let Gtk handle pending events, so the interface doesn't look hung.
+    
+    Thumbnails keep arriving from the thumb_pool while files are loading,
+    so the queue may never run dry. Only up to limit events are handled per
+    call, rather than spinning here until it does.
+    """
+    for i in xrange(limit):
+        if not Gtk.events_pending():
+            break
+        Gtk.main_iteration_do(False)
+
 def clear_all_gpx(widget=None):
     """Forget all GPX data, start over with a clean slate."""
     for polygon in polygons:
@@ -206,6 +233,7 @@ def clear_all_gpx(widget=None):
     
     del polygons[:]
     points.clear()
+    del stamps[:]
     metadata.omega = float('-inf')   # Final GPX track point
     metadata.alpha = float('inf')    # Initial GPX track point
     gpx_sensitivity()
@@ -21,8 +21,8 @@ from math import acos, sin, cos, radians
 from time import strftime, localtime
 from math import modf as split_float
 from os.path import join, basename
+from os import environ
 from gettext import gettext as _
-from fractions import Fraction
 from pyexiv2 import Rational
 
 from territories import get_state, get_country
@@ -30,12 +30,20 @@ from build_info import PKG_DATA_DIR
 
 EARTH_RADIUS = 6371 #km
 
+# Pango markup for the filename and summary shown in the photo list.
+SUMMARY = ('<span size="larger">%s</span>\n'
+           '<span style="italic" size="smaller">%s</span>')
+
 def dms_to_decimal(degrees, minutes, seconds, sign=' '):
-    """Convert degrees, minutes, seconds into decimal degrees."""
+    """Convert degrees, minutes, seconds into decimal degrees.
+    
+    The arguments are rationals, and dividing them out directly is quicker
+    than converting each of them with float().
+    """
     return (-1 if sign[0] in 'SWsw' else 1) * (
-        float(degrees)        +
-        float(minutes) / 60   +
-        float(seconds) / 3600
+        degrees.numerator / degrees.denominator        +
+        minutes.numerator / minutes.denominator / 60   +
+        seconds.numerator / seconds.denominator / 3600
     )
 
 def decimal_to_dms(decimal):
@@ -49,26 +57,47 @@ def decimal_to_dms(decimal):
     ]
 
 def float_to_rational(value):
-    """Create a pyexiv2.Rational with help from fractions.Fraction."""
-    frac = Fraction(abs(value)).limit_denominator(99999)
-    return Rational(frac.numerator, frac.denominator)
+    """Create a pyexiv2.Rational approximating the absolute value of a float.
+    
+    EXIF rationals are pairs of unsigned 32 bit integers, so this simply uses
+    the largest denominator that can't overflow the numerator.
+    """
+    value = abs(value)
+    denominator = max(1, 4294967295 // (int(value) + 1))
+    return Rational(int(round(value * denominator)), denominator)
 
-def valid_coords(lat, lon):
-    """Determine the validity of coordinates."""
-    if type(lat) not in (float, int): return False
-    if type(lon) not in (float, int): return False
-    return abs(lat) <= 90 and abs(lon) <= 180
+def valid_coords(lat, lon, numbers=frozenset((float, int))):
+    """Determine the validity of coordinates.
+    
+    Anything that isn't a plain float or int, including None, is invalid.
+    The numbers argument only makes that check a local lookup, and should
+    not be passed.
+    """
+    return (type(lat) in numbers and type(lon) in numbers and
+            -90 <= lat <= 90 and -180 <= lon <= 180)
 
 def format_list(strings, joiner=', '):
     """Join geonames with a comma, ignoring missing names."""
     return joiner.join([name for name in strings if name])
 
-def format_coords(lat, lon):
-    """Add cardinal directions to decimal coordinates."""
-    return '%s %.5f, %s %.5f' % (
-        _('N') if lat >= 0 else _('S'), abs(lat),
-        _('E') if lon >= 0 else _('W'), abs(lon)
-    )
+def format_coords(lat, lon, cache={}):
+    """Add cardinal directions to decimal coordinates.
+    
+    This is called for every movement of the map, and gettext is fairly slow,
+    so results are cached by hemisphere and the coordinates as displayed.
+    The cache argument persists across calls to this method and should not
+    be passed as an argument.
+    """
+    key = (lat >= 0, '%.5f' % abs(lat), lon >= 0, '%.5f' % abs(lon))
+    if key not in cache:
+        if len(cache) > 1024:
+            cache.clear()
+        north, lat_text, east, lon_text = key
+        cache[key] = '%s %s, %s %s' % (
+            _('N') if north else _('S'), lat_text,
+            _('E') if east else _('W'), lon_text
+        )
+    return cache[key]
 
 
 class Coordinates():
@@ -142,10 +171,23 @@ class Coordinates():
         self.timezone      = tz.strip()
         return self.timezone
     
-    def pretty_time(self):
-        """Convert epoch seconds to a human-readable date."""
+    def pretty_time(self, cache={}):
+        """Convert epoch seconds to a human-readable date.
+        
+        This is part of every photo summary, which is regenerated each time a
+        photo moves, so results are cached. Local time depends on the TZ
+        environment variable, which changes with the selected timezone, so it
+        is part of the key. The cache argument persists across calls to this
+        method and should not be passed as an argument.
+        """
         if type(self.timestamp) is int:
-            return strftime('%Y-%m-%d %X', localtime(self.timestamp))
+            key = (self.timestamp, environ.get('TZ'))
+            if key not in cache:
+                if len(cache) > 8192:
+                    cache.clear()
+                cache[key] = strftime('%Y-%m-%d %X',
+                                      localtime(self.timestamp))
+            return cache[key]
     
     def pretty_coords(self):
         """Add cardinal directions to decimal coordinates."""
@@ -171,8 +213,5 @@ class Coordinates():
     
     def long_summary(self):
         """Longer summary with Pango markup."""
-        return '<span %s>%s</span>\n<span %s>%s</span>' % (
-            'size="larger"', basename(self.filename),
-            'style="italic" size="smaller"', self.short_summary()
-        )
+        return SUMMARY % (basename(self.filename), self.short_summary())
 
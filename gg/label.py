@@ -23,13 +23,20 @@ from os.path import basename
 from common import get_obj, map_view, selected, modified, photos
 
 def update_highlights(selection):
-    """Ensure only the selected labels are highlighted."""
-    selection_exists = selection.count_selected_rows() > 0
+    """Ensure only the selected labels are highlighted.
+    
+    The 'selected' set() is rebuilt from just the selected rows, rather than
+    asking the selection about every loaded photo. The first column of each
+    row holds the filename of its photo.
+    """
+    model, paths = selection.get_selected_rows()
     selected.clear()
-    for photo in photos.values():
-        # Maintain the 'selected' set() for easier iterating later.
-        if selection.iter_is_selected(photo.iter):
+    for path in paths:
+        photo = photos.get(model.get_value(model.get_iter(path), 0))
+        if photo is not None:
             selected.add(photo)
+    selection_exists = len(paths) > 0
+    for photo in photos.values():
         photo.set_label_highlight(photo in selected, selection_exists)
 
 def selection_sensitivity(selection, aply, close, save, revert):
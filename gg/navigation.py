@@ -17,46 +17,64 @@
 
 from __future__ import division
 
-from gi.repository import Gtk, Gdk
+from gi.repository import Gtk, Gdk, GLib, Champlain
+from collections import deque
 
 from common import get_obj, gst, map_view
-from gpsmath import Coordinates, valid_coords
+from gpsmath import Coordinates
 from version import APPNAME
 
-def move_by_arrow_keys(accel_group, acceleratable, keyval, modifier):
-    """Move the map view by 5% of its length in the given direction."""
-    key, view = Gdk.keyval_name(keyval), map_view
-    factor    = (0.45 if key in ('Up', 'Left') else 0.55)
-    lat       = view.get_center_latitude()
-    lon       = view.get_center_longitude()
-    if key in ('Up', 'Down'):
-        lat = view.y_to_latitude(view.get_height() * factor)
-    else:
-        lon = view.x_to_longitude(view.get_width() * factor)
-    if valid_coords(lat, lon):
-        view.center_on(lat, lon)
+# How far each arrow key moves the map, as a fraction of the view's size.
+ARROW_KEYS = {
+    Gdk.KEY_Up:    0.45,
+    Gdk.KEY_Down:  0.55,
+    Gdk.KEY_Left:  0.45,
+    Gdk.KEY_Right: 0.55,
+}
+
+def move_vertically(accel_group, acceleratable, keyval, modifier,
+                    view=map_view, keys=ARROW_KEYS):
+    """Move the map view up or down by 5% of its height.
+    
+    The view and keys arguments only exist to make those lookups local to
+    this frequently-called method, and should not be passed as arguments.
+    """
+    lat = view.y_to_latitude(view.get_height() * keys[keyval])
+    if -90 <= lat <= 90:
+        view.center_on(lat, view.get_center_longitude())
+
+def move_horizontally(accel_group, acceleratable, keyval, modifier,
+                      view=map_view, keys=ARROW_KEYS):
+    """Move the map view left or right by 5% of its width.
+    
+    The view and keys arguments only exist to make those lookups local to
+    this frequently-called method, and should not be passed as arguments.
+    """
+    lon = view.x_to_longitude(view.get_width() * keys[keyval])
+    if -180 <= lon <= 180:
+        view.center_on(view.get_center_latitude(), lon)
 
 def remember_location(view):
-    """Add current location to history stack."""
-    history = list(gst.get('history'))
-    location = tuple(view.get_property(x) for x in
-            ('latitude', 'longitude', 'zoom-level'))
+    """Add current location to history stack, keeping the last 30 places."""
+    history = deque(gst.get('history'), 30)
+    get = view.get_property
+    location = (get('latitude'), get('longitude'), get('zoom-level'))
     if history[-1] != location:
         history.append(location)
-    gst.set_history(history[-30:])
+        gst.set_history(list(history))
 
-def go_back(button, view):
+def go_back(view):
     """Return the map view to where the user last set it."""
     history = list(gst.get('history'))
     lat, lon, zoom = history.pop()
-    if valid_coords(lat, lon):
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
         view.set_zoom_level(zoom)
         view.center_on(lat, lon)
     if len(history) > 1:
         gst.set_history(history)
     else:
         gst.reset('history')
-    map_view.emit('animation-completed')
+    view.emit('animation-completed')
 
 def set_window_title(view, set_title, center):
     """Add the current location we are looking at into the titlebar."""
@@ -77,13 +95,14 @@ class NavigationController():
     
     def __init__(self):
         """Start the map at the previous location, and connect signals."""
-        perform_zoom    = lambda button, zoom: zoom()
         back_button     = get_obj('back_button')
         zoom_in_button  = get_obj('zoom_in_button')
         zoom_out_button = get_obj('zoom_out_button')
-        zoom_out_button.connect('clicked', perform_zoom, map_view.zoom_out)
-        zoom_in_button.connect('clicked', perform_zoom, map_view.zoom_in)
-        back_button.connect('clicked', go_back, map_view)
+        zoom_out_button.connect_object('clicked',
+            Champlain.View.zoom_out, map_view)
+        zoom_in_button.connect_object('clicked',
+            Champlain.View.zoom_in, map_view)
+        back_button.connect_object('clicked', go_back, map_view)
         
         for key in ['latitude', 'longitude', 'zoom-level']:
             gst.bind(key, map_view, key)
@@ -91,14 +110,34 @@ class NavigationController():
         accel = Gtk.AccelGroup()
         window = get_obj('main')
         window.add_accel_group(accel)
-        for key in [ 'Left', 'Right', 'Up', 'Down' ]:
-            accel.connect(Gdk.keyval_from_name(key),
-                Gdk.ModifierType.MOD1_MASK, 0, move_by_arrow_keys)
+        for keyval, move in [ (Gdk.KEY_Up,    move_vertically),
+                              (Gdk.KEY_Down,  move_vertically),
+                              (Gdk.KEY_Left,  move_horizontally),
+                              (Gdk.KEY_Right, move_horizontally) ]:
+            accel.connect(keyval, Gdk.ModifierType.MOD1_MASK, 0, move)
         
         map_view.connect('notify::zoom-level', zoom_button_sensitivity,
             zoom_in_button.set_sensitive, zoom_out_button.set_sensitive)
         map_view.connect('realize', remember_location)
-        map_view.connect('animation-completed', set_window_title,
+        self.title_pending = False
+        map_view.connect('animation-completed', self.queue_window_title,
             window.set_title, Coordinates())
         map_view.emit('animation-completed')
+    
+    def queue_window_title(self, view, set_title, center):
+        """Update the titlebar once per burst of map movement.
+        
+        animation-completed is often emitted several times in a row, and
+        looking up the geoname is expensive, so wait for the main loop to go
+        idle and then only do it once.
+        """
+        if not self.title_pending:
+            self.title_pending = True
+            GLib.idle_add(self.update_window_title, view, set_title, center)
+    
+    def update_window_title(self, view, set_title, center):
+        """Perform the titlebar update that was queued above."""
+        self.title_pending = False
+        set_window_title(view, set_title, center)
+        return False
 
@@ -31,6 +31,11 @@ from territories import get_state, get_country
 GPS  = 'Exif.GPSInfo.GPS'
 IPTC = 'Iptc.Application2.'
 
+# EXIF reference values, indexed by whether the coordinate is non-negative.
+LAT_REF = ('S', 'N')
+LON_REF = ('W', 'E')
+ALT_REF = ('1', '0')
+
 
 class Photograph(Coordinates):
     """Represents a single photograph and it's location in space and time."""
@@ -45,6 +50,7 @@ class Photograph(Coordinates):
         self.exif     = None
         self.thumb    = None
         self.manual   = None
+        self.preview  = None
     
     def read(self):
         """Load exif data from disk."""
@@ -62,21 +68,14 @@ class Photograph(Coordinates):
         
         Camera(self.exif)
         
-        # Try to get a thumbnail.
-        try:
-            self.thumb = GdkPixbuf.Pixbuf.new_from_file_at_size(
-                    self.filename, self.thm_size, self.thm_size)
-        except GObject.GError:
-            if len(self.exif.previews) > 0:
-                data = self.exif.previews[-1].data
-            elif len(self.exif.exif_thumbnail.data) > 0:
-                data = self.exif.exif_thumbnail.data
-            else:
+        # When gdk-pixbuf can't read the photo itself, pick out an embedded
+        # image for load_thumb here, since it runs in a thread and so must
+        # not touch self.exif.
+        self.preview = None
+        if GdkPixbuf.Pixbuf.get_file_info(self.filename)[0] is None:
+            self.preview = self.embedded_preview()
+            if self.preview is None:
                 raise IOError
-            
-            self.thumb = GdkPixbuf.Pixbuf.new_from_stream_at_scale(
-                Gio.MemoryInputStream.new_from_data(data, None),
-                self.thm_size, self.thm_size, True, None)
         
         self.calculate_timestamp()
         try:
@@ -97,6 +96,51 @@ class Photograph(Coordinates):
         except KeyError:
             pass
     
+    def embedded_preview(self, fits=False):
+        """Return the data of an image embedded in the EXIF, if there is one.
+        
+        Listing the previews copies all of their data out of exiv2, so this
+        is only meant for when the photo itself can't be used, or for single
+        photos. If fits is True, only return the smallest preview that's big
+        enough to be scaled down to the thumbnail size.
+        """
+        previews = self.exif.previews
+        if fits:
+            for preview in previews:
+                if max(preview.dimensions) >= self.thm_size:
+                    return preview.data
+        elif len(previews) > 0:
+            return previews[-1].data
+        elif len(self.exif.exif_thumbnail.data) > 0:
+            return self.exif.exif_thumbnail.data
+    
+    def load_thumb(self):
+        """Decode a thumbnail of this photo, or of the chosen preview.
+        
+        Decoding and scaling the whole JPEG is the slowest part of loading a
+        photo, so this is kept out of read() and can be run from a thread.
+        If the preview attribute holds embedded image data, that is decoded
+        instead, and then released.
+        
+        Raises IOError if the thumbnail couldn't be decoded.
+        """
+        preview, self.preview = self.preview, None
+        try:
+            if preview is None:
+                self.thumb = GdkPixbuf.Pixbuf.new_from_file_at_size(
+                        self.filename, self.thm_size, self.thm_size)
+            else:
+                self.thumb = self.scale_data(preview)
+        except GObject.GError:
+            raise IOError
+        return self.thumb
+    
+    def scale_data(self, data):
+        """Decode an in-memory image into a thumbnail sized pixbuf."""
+        return GdkPixbuf.Pixbuf.new_from_stream_at_scale(
+            Gio.MemoryInputStream.new_from_data(data, None),
+            self.thm_size, self.thm_size, True, None)
+    
     def calculate_timestamp(self):
         """Determine the timestamp based on the currently selected timezone.
         
@@ -115,11 +159,11 @@ class Photograph(Coordinates):
         """Save exif data to photo file on disk."""
         if self.altitude is not None:
             self.exif[GPS + 'Altitude']    = float_to_rational(self.altitude)
-            self.exif[GPS + 'AltitudeRef'] = '0' if self.altitude >= 0 else '1'
+            self.exif[GPS + 'AltitudeRef'] = ALT_REF[self.altitude >= 0]
         self.exif[GPS + 'Latitude']     = decimal_to_dms(self.latitude)
-        self.exif[GPS + 'LatitudeRef']  = 'N' if self.latitude >= 0 else 'S'
+        self.exif[GPS + 'LatitudeRef']  = LAT_REF[self.latitude >= 0]
         self.exif[GPS + 'Longitude']    = decimal_to_dms(self.longitude)
-        self.exif[GPS + 'LongitudeRef'] = 'E' if self.longitude >= 0 else 'W'
+        self.exif[GPS + 'LongitudeRef'] = LON_REF[self.longitude >= 0]
         self.exif[GPS + 'MapDatum']     = 'WGS-84'
         self.exif.write()
     
@@ -144,13 +188,24 @@ class Photograph(Coordinates):
             self.label.hide()
     
     def set_label_highlight(self, highlight, transparent):
-        """Set the highlightedness of the given photo's ChamplainLabel."""
-        if self.label.get_property('visible'):
-            self.label.set_scale(*[1.1 if highlight else 1] * 2)
-            self.label.set_selected(highlight)
-            self.label.set_opacity(64 if transparent and not highlight else 255)
+        """Set the highlightedness of the given photo's ChamplainLabel.
+        
+        Every label is updated on each selection change, but most of them
+        don't actually change, so skip those rather than redrawing them.
+        """
+        label = self.label
+        if label.get_property('visible'):
+            scale   = 1.1 if highlight else 1
+            opacity = 64 if transparent and not highlight else 255
+            if (label.get_selected() == highlight and
+                label.get_opacity() == opacity and
+                label.get_scale() == (scale, scale)):
+                return
+            label.set_scale(scale, scale)
+            label.set_selected(highlight)
+            label.set_opacity(opacity)
             if highlight:
-                self.label.raise_top()
+                label.raise_top()
     
     def set_geodata(self, data):
         """Override Coordinates.set_geodata to apply directly into IPTC."""
@@ -20,6 +20,7 @@ from __future__ import division
 from gi.repository import Gtk, Gdk
 from gi.repository import Champlain
 from gi.repository import Clutter
+from collections import namedtuple
 from time import tzset
 from os import environ
 
@@ -32,52 +33,89 @@ def make_clutter_color(color):
     return Clutter.Color.new(
         *[x / 256 for x in [color.red, color.green, color.blue, 32768]])
 
-MAP_SOURCES = {}
+# Renderers only hold the tile being drawn, and only one map source is ever
+# displayed at a time, so every source can safely share the same instances.
+renderer      = Champlain.ImageRenderer()
+factory       = Champlain.MapSourceFactory.dup_default()
+error_sources = {}
 
-for map_desc in [
-    ['osm-mapnik', 'OpenStreetMap Mapnik', 0, 18, 256,
+# Enough memory cache to hold a screenful of tiles and some of the surrounding
+# area, so that panning back and forth doesn't have to hit the disk.
+memory_cache_tiles = gst.get_int('memory-cache-tiles')
+file_cache_bytes   = gst.get_int('file-cache-bytes')
+
+MapDescription = namedtuple('MapDescription', ['mapid', 'name', 'min_zoom',
+    'max_zoom', 'size', 'license', 'lic_uri', 'tile_uri'])
+
+MAP_DESCRIPTIONS = dict((desc.mapid, desc) for desc in
+    map(MapDescription._make, (
+    ('osm-mapnik', 'OpenStreetMap Mapnik', 0, 18, 256,
     'Map data is CC-BY-SA 2.0 OpenStreetMap contributors',
     'http://creativecommons.org/licenses/by-sa/2.0/',
-    'http://tile.openstreetmap.org/#Z#/#X#/#Y#.png'],
+    'http://tile.openstreetmap.org/#Z#/#X#/#Y#.png'),
     
-    ['osm-cyclemap', 'OpenStreetMap Cycle Map', 0, 17, 256,
+    ('osm-cyclemap', 'OpenStreetMap Cycle Map', 0, 17, 256,
     'Map data is CC-BY-SA 2.0 OpenStreetMap contributors',
     'http://creativecommons.org/licenses/by-sa/2.0/',
-    'http://a.tile.opencyclemap.org/cycle/#Z#/#X#/#Y#.png'],
+    'http://a.tile.opencyclemap.org/cycle/#Z#/#X#/#Y#.png'),
     
-    ['osm-transport', 'OpenStreetMap Transport Map', 0, 18, 256,
+    ('osm-transport', 'OpenStreetMap Transport Map', 0, 18, 256,
     'Map data is CC-BY-SA 2.0 OpenStreetMap contributors',
     'http://creativecommons.org/licenses/by-sa/2.0/',
-    'http://tile.xn--pnvkarte-m4a.de/tilegen/#Z#/#X#/#Y#.png'],
+    'http://tile.xn--pnvkarte-m4a.de/tilegen/#Z#/#X#/#Y#.png'),
     
-    ['mapquest-osm', 'MapQuest OSM', 0, 17, 256,
+    ('mapquest-osm', 'MapQuest OSM', 0, 17, 256,
     'Map data provided by MapQuest, Open Street Map and contributors',
     'http://creativecommons.org/licenses/by-sa/2.0/',
-    'http://otile1.mqcdn.com/tiles/1.0.0/osm/#Z#/#X#/#Y#.png'],
+    'http://otile1.mqcdn.com/tiles/1.0.0/osm/#Z#/#X#/#Y#.png'),
     
-    ['mff-relief', 'Maps for Free Relief', 0, 11, 256,
+    ('mff-relief', 'Maps for Free Relief', 0, 11, 256,
     'Map data available under GNU Free Documentation license, v1.2 or later',
     'http://www.gnu.org/copyleft/fdl.html',
-    'http://maps-for-free.com/layer/relief/z#Z#/row#Y#/#Z#_#X#-#Y#.jpg'],
-    ]:
-    mapid, name, min_zoom, max_zoom, size, license, lic_uri, tile_uri = map_desc
-    
-    c = Champlain.MapSourceChain()
-    c.push(Champlain.MapSourceFactory.dup_default().create_error_source(size))
+    'http://maps-for-free.com/layer/relief/z#Z#/row#Y#/#Z#_#X#-#Y#.jpg'),
+    )))
+
+
+class MapSources(dict):
+    """Only build the map source chains that are actually displayed.
     
-    c.push(Champlain.NetworkTileSource.new_full(
-        mapid, name, license, lic_uri, min_zoom, max_zoom,
-        size, Champlain.MapProjection.MAP_PROJECTION_MERCATOR,
-        tile_uri, Champlain.ImageRenderer()))
+    Every chain needs a FileCache of its own, because pushing a source into
+    a chain links it to the next source down that chain. Each FileCache
+    opens the tile database on disk, so there's no sense paying for that
+    until the user actually picks that map.
+    """
+    def __missing__(self, mapid):
+        desc = MAP_DESCRIPTIONS[mapid]
+        if desc.size not in error_sources:
+            error_sources[desc.size] = factory.create_error_source(desc.size)
+        
+        c = self[mapid] = Champlain.MapSourceChain()
+        c.push(error_sources[desc.size])
+        
+        c.push(Champlain.NetworkTileSource.new_full(
+            desc.mapid, desc.name, desc.license, desc.lic_uri,
+            desc.min_zoom, desc.max_zoom, desc.size,
+            Champlain.MapProjection.MAP_PROJECTION_MERCATOR,
+            desc.tile_uri, renderer))
+        
+        c.push(Champlain.FileCache.new_full(file_cache_bytes, None, renderer))
+        c.push(Champlain.MemoryCache.new_full(memory_cache_tiles, renderer))
+        return c
     
-    c.push(Champlain.FileCache.new_full(1e8, None, Champlain.ImageRenderer()))
-    c.push(Champlain.MemoryCache.new_full(100,     Champlain.ImageRenderer()))
-    MAP_SOURCES[mapid] = c
+    def get(self, mapid, default=None):
+        """Build the chain for a known map id, or return default otherwise.
+        
+        bind_with_convert relies on this returning None for unknown ids,
+        rather than raising KeyError like __missing__ would.
+        """
+        return self[mapid] if mapid in MAP_DESCRIPTIONS else default
+
+MAP_SOURCES = MapSources()
 
 
 def map_source_menu():
     """Load the predefined map sources into a menu the user can use."""
-    radio_group = []
+    menu_item = None
     map_menu = get_obj('map_source_menu')
     last_source = gst.get_string('map-source-id')
     gst.bind_with_convert('map-source-id', map_view, 'map-source',
@@ -85,16 +123,14 @@ def map_source_menu():
     menu_item_clicked = (lambda item, mapid: item.get_active() and
         map_view.set_map_source(MAP_SOURCES[mapid]))
     
-    for i, source_id in enumerate(sorted(MAP_SOURCES.keys())):
-        source = MAP_SOURCES[source_id]
-        menu_item = Gtk.RadioMenuItem.new_with_label(radio_group,
-                                                     source.get_name())
-        radio_group.append(menu_item)
+    for source_id in sorted(MAP_DESCRIPTIONS):
+        menu_item = Gtk.RadioMenuItem.new_with_label_from_widget(menu_item,
+                                        MAP_DESCRIPTIONS[source_id].name)
         if last_source == source_id:
             menu_item.set_active(True)
         menu_item.connect('activate', menu_item_clicked, source_id)
-        map_menu.attach(menu_item, 0, 1, i, i+1)
-    map_menu.show_all()
+        map_menu.append(menu_item)
+        menu_item.show()
 
 
 class PreferencesController():
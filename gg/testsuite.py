@@ -17,7 +17,7 @@
 
 from __future__ import division
 
-from gi.repository import Gdk, Clutter, Champlain
+from gi.repository import Gtk, Gdk, GLib, Clutter, Champlain
 from unittest import TestCase, TextTestRunner, TestLoader
 from os import listdir, system, environ
 from os.path import join, abspath
@@ -33,7 +33,8 @@ from gpsmath import decimal_to_dms, dms_to_decimal, float_to_rational
 from preferences import MAP_SOURCES, make_clutter_color
 from common import Struct, Polygon, polygons, map_view
 from common import points, photos, selected, modified
-from navigation import move_by_arrow_keys
+from navigation import move_horizontally, move_vertically
+from xmlfiles import parse_gpx_time, parse_kml_time
 from build_info import PKG_DATA_DIR
 
 gui = app.GottenGeography()
@@ -67,16 +68,20 @@ class GottenGeographyTester(TestCase):
         control = ActorController()
         link = get_obj('maps_link')
         map_view.center_on(50, 50)
+        gui.redraw_interface()
         self.assertEqual(control.label.get_text(), 'N 50.00000, E 50.00000')
         self.assertEqual(link.get_current_uri()[:45],
             'http://maps.google.com/maps?ll=50.0,50.0&spn=')
         map_view.center_on(-10, -30)
+        gui.redraw_interface()
         self.assertEqual(control.label.get_text(), 'S 10.00000, W 30.00000')
         self.assertEqual(link.get_current_uri()[:47],
             'http://maps.google.com/maps?ll=-10.0,-30.0&spn=')
         for rot in control.xhair.get_rotation(Clutter.RotateAxis.Z_AXIS):
             self.assertEqual(rot, 0)
         control.animate_in(10)
+        GLib.timeout_add(100, Gtk.main_quit)
+        Gtk.main()
         self.assertEqual(control.xhair.get_rotation(Clutter.RotateAxis.Z_AXIS)[0], 45)
         self.assertEqual(control.xhair.get_size(), (8, 9))
         self.assertEqual(control.black.get_width(), map_view.get_width())
@@ -350,6 +355,19 @@ class GottenGeographyTester(TestCase):
         photo.timestamp = 999999999
         self.assertEqual(photo.pretty_time(), '2001-09-08 07:46:39 PM')
         
+        for when in ['2001-09-09T01:46:39Z', '2001-09-09T01:46:39.25Z',
+                     '2001-09-08T19:46:39-06:00', '2001-09-09 01:46:39Z',
+                     '2001-09-09 01:46:39 UTC']:
+            self.assertEqual(parse_kml_time(when), 999999999)
+        
+        for when in ['2001-09-09T01:46:39Z', '2001-09-09T01:46:39.25Z',
+                     '2001-09-09T01:46:39', '2001-09-09T03:46:39+02:00',
+                     '2001-09-08T19:46:39-06:00',
+                     '2001-09-08T19:46:39.5-06:00']:
+            self.assertEqual(parse_gpx_time(when), 999999999)
+        self.assertRaises(ValueError, parse_gpx_time,
+            '2001-09-08T19:46:39 UTC')
+        
         photo.altitude = None
         self.assertIsNone(photo.pretty_elevation())
         photo.altitude = -10.20005
@@ -448,6 +466,7 @@ S 10.00000, W 10.00000
         ]]
         map_view.emit('realize')
         map_view.emit('animation-completed')
+        gui.redraw_interface()
         self.assertGreater(len(get_obj('main').get_title()[18:]), 5)
         
         lat = round(random_coord(90),  6)
@@ -494,37 +513,37 @@ S 10.00000, W 10.00000
         lat = map_view.get_property('latitude')
         lon = map_view.get_property('longitude')
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Left"), None)
+        move_horizontally(None, None, Gdk.keyval_from_name("Left"), None)
         self.assertAlmostEqual(lat, map_view.get_property('latitude'), 4)
         self.assertGreater(    lon, map_view.get_property('longitude'))
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Right"), None)
+        move_horizontally(None, None, Gdk.keyval_from_name("Right"), None)
         self.assertAlmostEqual(lat, map_view.get_property('latitude'), 4)
         self.assertAlmostEqual(lon, map_view.get_property('longitude'), 0)
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Right"), None)
+        move_horizontally(None, None, Gdk.keyval_from_name("Right"), None)
         self.assertLess(       lon, map_view.get_property('longitude'))
         self.assertAlmostEqual(lat, map_view.get_property('latitude'), 4)
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Left"), None)
+        move_horizontally(None, None, Gdk.keyval_from_name("Left"), None)
         self.assertAlmostEqual(lon, map_view.get_property('longitude'), 0)
         self.assertAlmostEqual(lat, map_view.get_property('latitude'), 4)
         
         lon = map_view.get_property('longitude')
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Up"), None)
+        move_vertically(None, None, Gdk.keyval_from_name("Up"), None)
         self.assertAlmostEqual(lon, map_view.get_property('longitude'), 4)
         self.assertLess(       lat, map_view.get_property('latitude'))
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Down"), None)
+        move_vertically(None, None, Gdk.keyval_from_name("Down"), None)
         self.assertAlmostEqual(lon, map_view.get_property('longitude'), 4)
         self.assertAlmostEqual(lat, map_view.get_property('latitude'), 0)
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Down"), None)
+        move_vertically(None, None, Gdk.keyval_from_name("Down"), None)
         self.assertAlmostEqual(lon, map_view.get_property('longitude'), 4)
         self.assertGreater(    lat, map_view.get_property('latitude'))
         
-        move_by_arrow_keys(None, None, Gdk.keyval_from_name("Up"), None)
+        move_vertically(None, None, Gdk.keyval_from_name("Up"), None)
         self.assertAlmostEqual(lon, map_view.get_property('longitude'), 4)
         self.assertAlmostEqual(lat, map_view.get_property('latitude'), 0)
     
@@ -601,6 +620,7 @@ S 10.00000, W 10.00000
             self.assertAlmostEqual(lon, map_view.get_property('longitude'), 4)
             
             map_view.emit("animation-completed")
+            gui.redraw_interface()
             self.assertEqual(get_title(), "GottenGeography - " + loc)
         
         entry.set_text('calg')
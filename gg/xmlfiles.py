@@ -18,22 +18,33 @@
 from __future__ import division
 
 from xml.parsers.expat import ParserCreate, ExpatError
+from xml.etree.cElementTree import iterparse, ParseError
 from dateutil.parser import parse as parse_date
 from re import compile as re_compile
-from gi.repository import Gtk
 from calendar import timegm
+from logging import getLogger
 from time import clock
+from array import array
+from itertools import izip
 
 from gpsmath import Coordinates
-from common import add_polygon_to_map
+from common import add_polygon_to_map, pump_events
 
+log = getLogger(__name__)
 
-class XMLSimpleParser:
-    """A simple wrapper for the Expat XML parser."""
+
+class XMLSimpleParser(object):
+    """A simple wrapper for the Expat XML parser.
+    
+    Its handlers run for every element in the file, so attributes live in
+    slots rather than an instance dict.
+    """
+    __slots__ = ('rootname', 'watchlist', 'call_start', 'call_end',
+                 'element', 'tracking', 'state', 'parser')
     
     def __init__(self, rootname, watchlist):
         self.rootname = rootname
-        self.watchlist = watchlist
+        self.watchlist = frozenset(watchlist)
         self.call_start = None
         self.call_end = None
         self.element = None
@@ -41,6 +52,7 @@ class XMLSimpleParser:
         self.state = {}
         
         self.parser = ParserCreate()
+        self.parser.buffer_text = True
         self.parser.StartElementHandler = self.element_root
     
     def parse(self, filename, call_start, call_end):
@@ -49,7 +61,13 @@ class XMLSimpleParser:
         self.call_end = call_end
         try:
             with open(filename) as xml:
-                self.parser.ParseFile(xml)
+                # ParseFile only reads 2KB at a time, so feed Expat bigger
+                # chunks to spend less time going back and forth with it.
+                while True:
+                    chunk = xml.read(65536)
+                    self.parser.Parse(chunk, not chunk)
+                    if not chunk:
+                        break
         except ExpatError:
             raise IOError
    
@@ -61,27 +79,30 @@ class XMLSimpleParser:
     
     def element_start(self, name, attributes):
         """Only collect the attributes from XML elements that we care about."""
-        if not self.tracking:
-            if name not in self.watchlist:
-                return
-            if self.call_start(name, attributes):
-                # Start tracking this element, accumulate everything under it.
-                self.tracking = name
-                self.parser.CharacterDataHandler = self.element_data
-                self.parser.EndElementHandler = self.element_end
-        
-        if self.tracking is not None:
-            self.element = name
-            self.state[name] = ''
+        if name not in self.watchlist:
+            return
+        if self.call_start(name, attributes):
+            # Start tracking this element, accumulate everything under it.
+            self.tracking = name
+            self.parser.StartElementHandler = self.element_child
+            self.parser.CharacterDataHandler = self.element_data
+            self.parser.EndElementHandler = self.element_end
+            self.element_child(name, attributes)
+    
+    def element_child(self, name, attributes):
+        """Collect the attributes of every element inside a tracked one."""
+        self.element = name
+        self.state[name] = ''
+        if attributes:
             self.state.update(attributes)
     
     def element_data(self, data):
         """Accumulate all data for an element.
         
-        Expat can call this handler multiple times with data chunks.
+        Expat buffers contiguous text into a single call, but can still call
+        this handler multiple times, eg when text surrounds a child element.
+        Whitespace is kept, so callers should strip values they care about.
         """
-        if not data or data.strip() == '':
-            return
         self.state[self.element] += data
     
     def element_end(self, name):
@@ -92,6 +113,7 @@ class XMLSimpleParser:
         self.call_end(name, self.state)
         self.tracking = None
         self.state.clear()
+        self.parser.StartElementHandler = self.element_start
         self.parser.CharacterDataHandler = None
         self.parser.EndElementHandler = None
 
@@ -99,78 +121,218 @@ class XMLSimpleParser:
 class TrackFile(Coordinates):
     """Parent class for all types of GPS track files.
     
-    Subclasses must implement element_start and element_end, and call them in
-    the base class.
+    Subclasses parsed with Expat must implement element_start and element_end,
+    and call them in the base class. They may also implement finish, which is
+    called once the whole file has been parsed. Subclasses may instead replace
+    parse entirely, in which case they should call pulse for each point.
     """
     
     def __init__(self, filename, root, watch, progressbar):
         self.progress = progressbar
         self.clock    = clock()
+        self.count    = 0
         self.append   = None
-        self.tracks   = {}
+        self.alpha    = float('inf')
+        self.omega    = float('-inf')
+        
+        # Parallel arrays of each track point's timestamp and coordinates.
+        self.timestamps = array('l')
+        self.markers    = []
+        
+        self.parse(filename, root, watch)
+        self.finish()
         
+        if self.timestamps:
+            self.alpha = min(self.timestamps)
+            self.omega = max(self.timestamps)
+    
+    def parse(self, filename, root, watch):
+        """Feed the watched elements to element_start and element_end."""
         self.parser = XMLSimpleParser(root, watch)
         self.parser.parse(filename, self.element_start, self.element_end)
-        
-        keys = self.tracks.keys()
-        self.alpha = min(keys)
-        self.omega = max(keys)
     
     def element_start(self, name, attributes):
         """Placeholder for a method that gets overridden in subclasses."""
         return False
     
+    def finish(self):
+        """Placeholder for a method that gets overridden in subclasses."""
+        pass
+    
     def element_end(self, name, state):
-        """Occasionally redraw the screen so the user can see what's happening."""
+        """Count each finished element towards the next redraw."""
+        self.pulse()
+    
+    def pulse(self):
+        """Occasionally redraw the screen so the user can see what's happening.
+        
+        Only every 1024th element even checks the clock, since this is called
+        for every single point and reading the clock isn't free.
+        """
+        self.count += 1
+        if self.count & 1023:
+            return
         if clock() - self.clock > .2:
             self.progress.pulse()
-            while Gtk.events_pending():
-                Gtk.main_iteration()
+            pump_events()
             self.clock = clock()
 
 
 # GPX files use ISO 8601 dates, which look like 2010-10-16T20:09:13Z.
-# This regex splits that up into a list like 2010, 10, 16, 20, 09, 13.
+# This regex splits that up into a list like 2010, 10, 16, 20, 09, 13, for
+# the rare files whose dates aren't laid out in exactly that format.
 split = re_compile(r'[:TZ-]').split
 
+# UTC offsets look like +02:00, -0600, or just Z for UTC itself.
+offset_format = re_compile(r'\A[+-]\d\d:?\d\d\Z').match
+
+def utc_offset(zone, offsets={None: 0, 'Z': 0}):
+    """Convert an ISO 8601 UTC offset into seconds to add to the local time.
+    
+    Files tend to use the same UTC offset throughout, so results are cached.
+    The offsets argument persists across calls to this method and should not
+    be passed as an argument. Raises ValueError if zone isn't an offset.
+    """
+    if zone not in offsets:
+        if not offset_format(zone):
+            raise ValueError('Invalid UTC offset: %s' % zone)
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        offsets[zone] = -offset if zone[0] == '+' else offset
+    return offsets[zone]
+
+def parse_gpx_time(time, cache={}, days={}):
+    """Convert a GPX timestamp into UTC epoch seconds.
+    
+    Dense or repeatedly loaded tracks parse the same strings over and over,
+    so results are cached. Tracks rarely span more than a few days, so the
+    epoch of each date is cached too, leaving only the time of day to add up.
+    The cache and days arguments persist across calls to this method and
+    should not be passed as arguments.
+    """
+    try:
+        return cache[time]
+    except KeyError:
+        if len(cache) > 100000:
+            cache.clear()
+        stamp = time.strip()
+        try:
+            # Slicing the fixed-width fields is much faster than the regex.
+            # Fractional seconds are dropped, but any UTC offset is applied.
+            zone = stamp[19:]
+            if zone[:1] == '.':
+                zone = zone[1:].lstrip('0123456789')
+            offset = utc_offset(zone or None)
+            date = stamp[0:10]
+            if date not in days:
+                days[date] = timegm((int(stamp[0:4]), int(stamp[5:7]),
+                                     int(stamp[8:10]), 0, 0, 0))
+            timestamp = (days[date] + int(stamp[11:13]) * 3600 +
+                         int(stamp[14:16]) * 60 + int(stamp[17:19]) + offset)
+        except ValueError:
+            # The regex would throw away a UTC offset, so refuse those here.
+            if '+' in stamp[10:] or '-' in stamp[10:]:
+                raise
+            timestamp = timegm(map(int, split(stamp)[0:6]))
+        cache[time] = timestamp
+        return timestamp
+
+# KML dates are almost always ISO 8601 as well, optionally with fractional
+# seconds or a UTC offset, so we can usually avoid dateutil's slow parser.
+# Anchoring both ends lets anything else fail the match as early as possible.
+iso8601 = re_compile(r'\A(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)'
+                     r'(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?\Z').match
+
+def parse_kml_time(when, cache={}):
+    """Convert a KML timestamp into UTC epoch seconds.
+    
+    Results are cached just like parse_gpx_time, and the cache argument
+    should not be passed as an argument either.
+    """
+    try:
+        return cache[when]
+    except KeyError:
+        pass
+    match = iso8601(when)
+    if match is None:
+        timestamp = timegm(parse_date(when).utctimetuple())
+    else:
+        fields = match.groups()
+        timestamp = timegm(map(int, fields[0:6])) + utc_offset(fields[6])
+    if len(cache) > 100000:
+        cache.clear()
+    cache[when] = timestamp
+    return timestamp
+
 
 class GPXFile(TrackFile):
     """Parse a GPX file."""
     
     def __init__(self, filename, progress):
-        TrackFile.__init__(self, filename, 'gpx',
-                           ['trkseg', 'trkpt'], progress)
+        # There's no watchlist, because parse doesn't use XMLSimpleParser.
+        TrackFile.__init__(self, filename, 'gpx', [], progress)
     
-    def element_start(self, name, attributes):
-        """Adds a new polygon for each new segment, and watches for track points."""
-        if name == 'trkseg':
-            self.append = add_polygon_to_map()
-        return name == 'trkpt'
+    def parse(self, filename, root, watch):
+        """Parse the file with ElementTree rather than Expat.
+        
+        cElementTree builds the elements in C, so Python only has to look at
+        the start of each trkseg and the end of each trkpt. Each trkpt is
+        cleared as soon as it's loaded, and each trkseg drops its emptied
+        trkpts when it ends, so memory use stays flat no matter the size.
+        """
+        try:
+            events = iterparse(filename, ('start', 'end'))
+            event, element = events.next()
+            namespace, brace, name = element.tag.rpartition('}')
+            if name != root:
+                raise IOError
+            namespace += brace
+            trkseg = namespace + 'trkseg'
+            trkpt  = namespace + 'trkpt'
+            tags   = (namespace + 'time', namespace + 'ele')
+            add_segment = self.add_segment
+            add_point   = self.add_point
+            for event, element in events:
+                if event == 'end':
+                    if element.tag == trkpt:
+                        add_point(element, tags)
+                        element.clear()
+                    elif element.tag == trkseg:
+                        element.clear()
+                elif element.tag == trkseg:
+                    add_segment()
+        except ParseError:
+            raise IOError
     
-    def element_end(self, name, state):
-        """Collect and use all the parsed data.
+    def add_segment(self):
+        """Adds a new polygon for each new trkseg."""
+        self.append = add_polygon_to_map()
+    
+    def add_point(self, trkpt, tags, float=float, gpx_time=parse_gpx_time):
+        """Collect and use all the parsed data of a trkpt element.
         
         This method does most of the heavy lifting, including parsing time
         strings into UTC epoch seconds, appending to the ChamplainMarkerLayers,
         keeping track of the first and last points loaded.
+        
+        The float and gpx_time arguments only exist to make those lookups
+        local to this frequently-called method, and should not be passed.
         """
-        # We only care about the trkpt element closing, because that means
-        # there is a new, fully-loaded GPX point to play with.
-        if name != 'trkpt':
-            return
+        time, ele = tags
         try:
-            timestamp = timegm(map(int, split(state['time'])[0:6]))
-            lat = float(state['lat'])
-            lon = float(state['lon'])
+            timestamp = gpx_time(trkpt.findtext(time))
+            lat = float(trkpt.get('lat'))
+            lon = float(trkpt.get('lon'))
         except Exception as error:
-            print error
+            log.debug('Skipping GPX track point: %s', error)
             # If any of lat, lon, or time is missing, we cannot continue.
             # Better to just give up on this track point and go to the next.
             return
         
-        self.tracks[timestamp] = self.append(lat, lon, float(state.get('ele', 0.0)))
+        marker = self.append(lat, lon, float(trkpt.findtext(ele, 0.0)))
+        self.timestamps.append(timestamp)
+        self.markers.append(marker)
         
-        TrackFile.element_end(self, name, state)
+        self.pulse()
 
 
 class KMLFile(TrackFile):
@@ -186,34 +348,54 @@ class KMLFile(TrackFile):
     def element_start(self, name, attributes):
         """Adds a new polygon for each new gx:Track, and watches for location data."""
         if name == 'gx:Track':
+            self.finish()
             self.append = add_polygon_to_map()
             return False
         return True
     
     def element_end(self, name, state):
-        """Watch for complete pairs of when and gx:coord tags.
+        """Collect the when and gx:coord tags of the current gx:Track.
         
-        This is accomplished by maintaining parallel arrays of each tag.
+        This is accomplished by maintaining parallel arrays of each tag,
+        which are paired up once the whole track has been read.
         """
         if name == 'when':
             try:
-                timestamp = timegm(parse_date(state['when']).utctimetuple())
+                timestamp = parse_kml_time(state['when'].strip())
             except Exception as error:
-                print error
+                log.debug('Skipping KML timestamp: %s', error)
                 return
             self.whens.append(timestamp)
-        if name == 'gx:coord':
-            self.coords.append(state['gx:coord'].split())
-        
-        complete = min(len(self.whens), len(self.coords))
-        if complete > 0:
-            for i in range(0, complete):
-                self.tracks[self.whens[i]] = \
-                    self.append(float(self.coords[i][1]), \
-                                float(self.coords[i][0]), \
-                                float(self.coords[i][2]))
-            self.whens = self.whens[complete:]
-            self.coords = self.coords[complete:]
+        elif name == 'gx:coord':
+            self.coords.append(state['gx:coord'])
         
         TrackFile.element_end(self, name, state)
-
+    
+    def finish(self):
+        """Pair up the when and gx:coord tags of the finished gx:Track.
+        
+        The first three values of each coord are gathered up so that every
+        coordinate in the track is converted to floats in one pass. Each coord
+        contributes at most three values, so a short one leaves the total
+        short, instead of shifting values into the next point.
+        
+        Raises IOError if any coord is malformed, like any other parse error.
+        """
+        append = self.append
+        markers = self.markers
+        coords = self.coords[0:len(self.whens)]
+        values = []
+        extend = values.extend
+        for coord in coords:
+            extend(coord.split()[0:3])
+        if len(values) != 3 * len(coords):
+            raise IOError
+        try:
+            values = iter(map(float, values))
+        except ValueError:
+            raise IOError
+        for lon, lat, ele in izip(values, values, values):
+            markers.append(append(lat, lon, ele))
+        self.timestamps.extend(self.whens[0:len(self.coords)])
+        self.whens  = []
+        self.coords = []